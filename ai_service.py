@@ -4,12 +4,158 @@ AI服務模組 - 整合多個先進AI模型
 """
 
 import os
-import json
-import requests
 import time
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+import random
+import asyncio
+import hashlib
+import threading
+import aiohttp
+import orjson
+from cachetools import TTLCache
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple
+from dataclasses import dataclass, replace
 from enum import Enum
+from semantic_cache import SemanticCache
+
+# 固定不變的請求內容，各次請求共用同一物件，只替換提示詞欄位
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+_GEMINI_GEN_CFG = {"temperature": 0.7, "maxOutputTokens": 1000}
+
+# 所有提供商共用的請求逾時設定
+_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+# 回應快取設定
+_CACHE_MAX_SIZE = 4096
+_CACHE_TTL = 3600
+
+# 對沖請求：提供商超過其平時延遲（平均加上數倍平均偏差）仍未回應時，並行啟動下一個
+_HEDGE_MIN_DELAY = 0.5
+_HEDGE_DEVIATION_FACTOR = 4
+
+# 提供商健康度統計：延遲與錯誤率的指數加權移動平均
+_LATENCY_EWMA_ALPHA = 0.2
+_LATENCY_DEV_ALPHA = 0.25
+_ERROR_EWMA_ALPHA = 0.1
+_ERROR_PENALTY = 5
+_ERROR_COOLDOWN_THRESHOLD = 0.5
+_ERROR_COOLDOWN_SECONDS = 30
+
+# 串流請求不限制總時間，只限制兩段資料之間的等待
+_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+
+# Hugging Face微批次設定
+_HF_MAX_BATCH_SIZE = 16
+_HF_BATCH_WINDOW = 0.02
+
+# 連線池與重試設定（所有提供商共用同一個連線器）
+_POOL_LIMIT = 100
+_POOL_SIZE_PER_HOST = 20
+_DNS_CACHE_TTL = 300
+_MAX_RETRIES = 3
+_BACKOFF_FACTOR = 0.3
+_MAX_BACKOFF = 30
+# 伺服器要求等待超過此秒數時不再重試，直接交由其他提供商處理
+_MAX_RETRY_AFTER = 30
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# 共用的aiohttp會話（延遲建立，跨提供商重複使用）
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+_session_lock = threading.Lock()
+
+async def _get_session() -> aiohttp.ClientSession:
+    """取得共用的aiohttp會話，必要時建立新的會話"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    stale = None
+    # 會話綁定於建立時的事件迴圈；Web應用共用背景迴圈，
+    # 其他入口（如asyncio.run）可能使用不同的迴圈，因此在迴圈改變時重建
+    with _session_lock:
+        if _session is None or _session.closed or _session_loop is not loop:
+            if _session is not None and not _session.closed:
+                stale = (_session, _session_loop)
+            connector = aiohttp.TCPConnector(
+                limit=_POOL_LIMIT,
+                limit_per_host=_POOL_SIZE_PER_HOST,
+                ttl_dns_cache=_DNS_CACHE_TTL,
+                use_dns_cache=True,
+                enable_cleanup_closed=True
+            )
+            _session = aiohttp.ClientSession(connector=connector, timeout=_REQUEST_TIMEOUT)
+            _session_loop = loop
+        session = _session
+    
+    if stale is not None:
+        _release_stale_session(*stale)
+    return session
+
+def _release_stale_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop):
+    """釋放被取代的會話；擁有事件迴圈的入口應在迴圈結束前呼叫close_session()"""
+    if loop.is_running():
+        # 原迴圈仍在其他執行緒執行，交由該迴圈關閉，避免跨執行緒操作其連線
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+        return
+    # 原迴圈已停止，其連線只能在該迴圈上關閉，此處無法釋放
+    print("⚠️ 事件迴圈結束前未呼叫close_session()，捨棄其共用會話，池中的連線將無法正常關閉")
+
+async def close_session():
+    """關閉共用的aiohttp會話；每個使用本模組的事件迴圈都應在結束前於該迴圈中呼叫"""
+    global _session, _session_loop
+    with _session_lock:
+        session, _session, _session_loop = _session, None, None
+    if session is not None and not session.closed:
+        await session.close()
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> Optional[float]:
+    """計算重試前的等待秒數；伺服器要求的等待過長時回傳None表示放棄重試"""
+    delay = min(_MAX_BACKOFF, _BACKOFF_FACTOR * (2 ** attempt)) + random.uniform(0, _BACKOFF_FACTOR)
+    if retry_after:
+        try:
+            requested = float(retry_after)
+        except ValueError:
+            # HTTP日期格式的Retry-After不解析，沿用退避時間
+            return delay
+        if requested > _MAX_RETRY_AFTER:
+            return None
+        delay = max(delay, requested)
+    return delay
+
+async def _post_json(url: str, headers: Dict[str, str], data: Dict[str, Any]) -> Any:
+    """發送POST請求並解析JSON回應，暫時性錯誤時依Retry-After或指數退避重試"""
+    session = await _get_session()
+    body = orjson.dumps(data)
+    for attempt in range(_MAX_RETRIES + 1):
+        retryable = attempt < _MAX_RETRIES
+        try:
+            async with session.post(url, headers=headers, data=body,
+                                    timeout=_REQUEST_TIMEOUT) as response:
+                delay = None
+                if retryable and response.status in _RETRY_STATUSES:
+                    delay = _retry_delay(attempt, response.headers.get('Retry-After'))
+                if delay is None:
+                    response.raise_for_status()
+                    return orjson.loads(await response.read())
+        except aiohttp.ClientConnectionError:
+            if not retryable:
+                raise
+            delay = _retry_delay(attempt, None)
+        await asyncio.sleep(delay)
+
+async def _stream_sse(url: str, headers: Dict[str, str], data: Dict[str, Any]) -> AsyncIterator[Any]:
+    """發送串流POST請求，逐一產生SSE事件中的JSON資料"""
+    session = await _get_session()
+    async with session.post(url, headers=headers, data=orjson.dumps(data),
+                            timeout=_STREAM_TIMEOUT) as response:
+        response.raise_for_status()
+        async for raw_line in response.content:
+            line = raw_line.strip()
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                break
+            yield orjson.loads(payload)
 
 class AIProvider(Enum):
     OPENAI = "openai"
@@ -17,6 +163,14 @@ class AIProvider(Enum):
     GOOGLE = "google"
     HUGGINGFACE = "huggingface"
 
+# 各提供商同時進行的請求上限，依帳號等級的速率限制調整
+PROVIDER_CONCURRENCY = {
+    AIProvider.OPENAI: 10,
+    AIProvider.ANTHROPIC: 5,
+    AIProvider.GOOGLE: 10,
+    AIProvider.HUGGINGFACE: 4
+}
+
 @dataclass
 class AIResponse:
     content: str
@@ -26,6 +180,65 @@ class AIResponse:
     response_time: float
     confidence: float
 
+# 領域提示詞：(固定的系統提示詞, 用戶訊息標籤)
+# 固定內容放在前面、用戶訊息放在最後，讓各提供商的提示快取可以命中共同前綴
+DOMAIN_PROMPTS: Dict[str, Tuple[str, str]] = {
+    'math': ("""你是一位專業的數學導師。請針對以下數學問題提供詳細、準確的解答。
+
+請提供：
+1. 清晰的解題步驟
+2. 相關的數學概念解釋
+3. 如果可能，提供多種解法
+4. 實際應用例子""", "問題："),
+    
+    'programming': ("""你是一位資深的程式設計專家。請針對以下編程問題提供專業建議。
+
+請提供：
+1. 清晰的代碼解決方案
+2. 代碼解釋和最佳實踐
+3. 可能的優化建議
+4. 相關的技術背景""", "問題："),
+    
+    'writing': ("""你是一位專業的寫作指導老師。請針對以下寫作需求提供幫助。
+
+請提供：
+1. 創意和結構建議
+2. 具體的寫作技巧
+3. 範例或模板
+4. 改進建議""", "需求："),
+    
+    'dialogue': ("""你是一位智慧的對話夥伴。請針對以下話題進行深入、有趣的對話。
+
+請提供：
+1. 深思熟慮的回應
+2. 相關的背景知識
+3. 引發思考的問題
+4. 實用的建議""", "話題："),
+    
+    'mun': ("""你是一位經驗豐富的外交顧問和模擬聯合國專家。請針對以下議題提供專業分析。
+
+請提供：
+1. 國際法和外交角度的分析
+2. 各國立場和利益考量
+3. 可能的解決方案
+4. 談判策略建議""", "議題：")
+}
+
+DEFAULT_PROMPT: Tuple[str, str] = ("""請針對以下問題提供專業、詳細的回答。
+
+請確保回答準確、有用且易於理解。""", "問題：")
+
+# 智能備用回應：(訊息前的文字, 訊息後的文字)
+FALLBACK_TEMPLATES: Dict[str, Tuple[str, str]] = {
+    'math': ("我理解您的數學問題「", "」。雖然目前無法提供完整的計算，但我建議您可以嘗試分解問題、查找相關公式，或使用數學工具來輔助解決。"),
+    'programming': ("關於您的編程問題「", "」，我建議您可以查閱官方文檔、搜索相關的代碼範例，或在開發者社群中尋求幫助。"),
+    'writing': ("對於您的寫作需求「", "」，我建議您可以先列出大綱、收集相關資料，並參考優秀的寫作範例來提升您的作品。"),
+    'dialogue': ("關於「", "」這個話題，這確實是一個值得深入討論的問題。我建議您可以從多個角度來思考，並歡迎進一步交流。"),
+    'mun': ("關於「", "」這個國際議題，建議您研究相關的國際法條文、各國官方立場，以及歷史先例來形成全面的分析。")
+}
+
+DEFAULT_FALLBACK: Tuple[str, str] = ("感謝您的問題「", "」。雖然目前遇到一些技術問題，但我會持續改進來為您提供更好的服務。")
+
 class AIServiceManager:
     """AI服務管理器 - 統一管理多個AI提供商"""
     
@@ -37,6 +250,20 @@ class AIServiceManager:
             AIProvider.GOOGLE,
             AIProvider.HUGGINGFACE
         ]
+        # 完全相同的(領域, 訊息)直接重用先前的回應
+        self._cache = TTLCache(maxsize=_CACHE_MAX_SIZE, ttl=_CACHE_TTL)
+        self._cache_lock = threading.Lock()
+        # 改寫過的近似問題由語義快取處理
+        self._semantic_cache = SemanticCache()
+        # 各提供商的延遲/錯誤率統計，用於動態調整容錯順序
+        self.stats = {
+            provider: {'ewma_ms': 1000.0, 'dev_ms': 500.0, 'err': 0.0, 'cooldown_until': 0.0}
+            for provider in AIProvider
+        }
+        self._stats_lock = threading.Lock()
+        # 客戶端限流號誌，需在執行中的事件迴圈內建立
+        self._semaphores: Dict[AIProvider, asyncio.Semaphore] = {}
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
         self._initialize_providers()
     
     def _initialize_providers(self):
@@ -60,98 +287,226 @@ class AIServiceManager:
                               preferred_provider: Optional[AIProvider] = None) -> AIResponse:
         """生成AI回應，支援多提供商容錯"""
         
+        # 檢查回應快取
+        cached, cache_key, embedding = await self._lookup_cache(message, domain)
+        if cached is not None:
+            return cached
+        
         # 構建提示詞
-        prompt = self._build_domain_prompt(message, domain)
+        system_prompt, user_prompt = self._build_domain_prompt(message, domain)
+        
+        # 對提供商發出對沖請求
+        response, last_error = await self._generate_hedged(
+            self._providers_in_order(preferred_provider), system_prompt, user_prompt, domain
+        )
+        if response is not None:
+            self._store_cache(cache_key, domain, embedding, response)
+            return response
+        
+        # 所有提供商都失敗，返回智能默認回應
+        return self._generate_intelligent_fallback(message, domain, last_error)
+    
+    async def stream_response(self, message: str, domain: str = "general",
+                              preferred_provider: Optional[AIProvider] = None) -> AsyncIterator[str]:
+        """以串流方式逐段產生AI回應；尚未輸出內容前失敗時改用下一個提供商"""
+        cached, cache_key, embedding = await self._lookup_cache(message, domain)
+        if cached is not None:
+            yield cached.content
+            return
+        
+        system_prompt, user_prompt = self._build_domain_prompt(message, domain)
+        
+        last_error = None
+        for provider in self._providers_in_order(preferred_provider):
+            service = self.providers[provider]
+            chunks = []
+            async with self._get_semaphore(provider):
+                start_time = time.monotonic()
+                try:
+                    async for chunk in service.stream(system_prompt, user_prompt, domain):
+                        chunks.append(chunk)
+                        yield chunk
+                except Exception as e:
+                    self._record_stats(provider, time.monotonic() - start_time, True)
+                    if chunks:
+                        # 已輸出部分內容，無法切換提供商
+                        raise
+                    last_error = e
+                    continue
+            
+            elapsed = time.monotonic() - start_time
+            content = "".join(chunks)
+            self._record_stats(provider, elapsed, not content)
+            if content:
+                self._store_cache(cache_key, domain, embedding, AIResponse(
+                    content=content,
+                    provider=provider.value,
+                    model=service.model,
+                    tokens_used=len(content) // 4,  # 估算
+                    response_time=elapsed,
+                    confidence=service.confidence
+                ))
+                return
+        
+        yield self._generate_intelligent_fallback(message, domain, last_error).content
+    
+    async def _lookup_cache(self, message: str, domain: str):
+        """查詢精確與語義快取，回傳(命中的回應, 快取鍵, 句向量)"""
+        cache_key = self._cache_key(message, domain)
+        with self._cache_lock:
+            cached = self._cache.get(cache_key)
+        if cached is not None:
+            return replace(cached, provider=f"{cached.provider}+cache"), cache_key, None
+        
+        embedding = None
+        if self._semantic_cache.enabled:
+            embedding = await asyncio.to_thread(self._semantic_cache.encode, message)
+            if embedding is not None:
+                similar = self._semantic_cache.lookup(domain, embedding)
+                if similar is not None:
+                    return replace(similar, provider=f"{similar.provider}+semantic_cache"), cache_key, embedding
         
-        # 確定使用順序
+        return None, cache_key, embedding
+    
+    def _store_cache(self, cache_key: bytes, domain: str, embedding, response: AIResponse):
+        """將提供商的回應寫入精確與語義快取"""
+        with self._cache_lock:
+            self._cache[cache_key] = response
+        if embedding is not None:
+            self._semantic_cache.add(domain, embedding, response)
+    
+    def _providers_in_order(self, preferred_provider: Optional[AIProvider]) -> List[AIProvider]:
+        """確定提供商的使用順序：指定的提供商優先，其餘依健康度排序"""
         providers_to_try = []
         if preferred_provider and preferred_provider in self.providers:
             providers_to_try.append(preferred_provider)
         
-        for provider in self.fallback_order:
-            if provider not in providers_to_try and provider in self.providers:
-                providers_to_try.append(provider)
-        
-        # 嘗試各個提供商
+        providers_to_try.extend(self._rank_providers(
+            [p for p in self.fallback_order if p not in providers_to_try and p in self.providers]
+        ))
+        return providers_to_try
+    
+    async def _generate_hedged(self, providers_to_try: List[AIProvider], system_prompt: str,
+                               user_prompt: str, domain: str) -> Tuple[Optional[AIResponse], Optional[Exception]]:
+        """依序啟動提供商；前一個在對沖延遲內未完成或失敗時，並行啟動下一個"""
+        remaining = list(providers_to_try)
+        pending = set()
         last_error = None
-        for provider in providers_to_try:
+        try:
+            hedge_delay = None
+            while remaining or pending:
+                if remaining:
+                    provider = remaining.pop(0)
+                    hedge_delay = self._hedge_delay(provider)
+                    pending.add(asyncio.create_task(self._call_provider(
+                        provider, system_prompt, user_prompt, domain
+                    )))
+                
+                # 只有最近啟動的提供商比其平時更慢時才對沖
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=hedge_delay if remaining else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if response and response.content:
+                        return response, last_error
+        finally:
+            # 取消仍在執行的較慢請求
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        return None, last_error
+    
+    async def _call_provider(self, provider: AIProvider, system_prompt: str,
+                             user_prompt: str, domain: str) -> AIResponse:
+        """在限流號誌內呼叫單一提供商，並記錄其延遲與錯誤統計"""
+        async with self._get_semaphore(provider):
+            start_time = time.monotonic()
             try:
-                service = self.providers[provider]
-                response = await service.generate(prompt, domain)
-                if response and response.content:
-                    return response
-            except Exception as e:
-                last_error = e
-                continue
+                response = await self.providers[provider].generate(system_prompt, user_prompt, domain)
+            except asyncio.CancelledError:
+                # 被對沖取消不代表提供商異常；花費的時間只是實際延遲的下限，僅用於調高平均
+                self._record_stats(provider, time.monotonic() - start_time, None)
+                raise
+            except Exception:
+                self._record_stats(provider, time.monotonic() - start_time, True)
+                raise
         
-        # 所有提供商都失敗，返回智能默認回應
-        return self._generate_intelligent_fallback(message, domain, last_error)
+        self._record_stats(provider, time.monotonic() - start_time, not (response and response.content))
+        return response
     
-    def _build_domain_prompt(self, message: str, domain: str) -> str:
-        """根據領域構建專業提示詞"""
-        domain_prompts = {
-            'math': f"""你是一位專業的數學導師。請針對以下數學問題提供詳細、準確的解答：
-問題：{message}
-
-請提供：
-1. 清晰的解題步驟
-2. 相關的數學概念解釋
-3. 如果可能，提供多種解法
-4. 實際應用例子""",
-            
-            'programming': f"""你是一位資深的程式設計專家。請針對以下編程問題提供專業建議：
-問題：{message}
-
-請提供：
-1. 清晰的代碼解決方案
-2. 代碼解釋和最佳實踐
-3. 可能的優化建議
-4. 相關的技術背景""",
-            
-            'writing': f"""你是一位專業的寫作指導老師。請針對以下寫作需求提供幫助：
-需求：{message}
-
-請提供：
-1. 創意和結構建議
-2. 具體的寫作技巧
-3. 範例或模板
-4. 改進建議""",
-            
-            'dialogue': f"""你是一位智慧的對話夥伴。請針對以下話題進行深入、有趣的對話：
-話題：{message}
-
-請提供：
-1. 深思熟慮的回應
-2. 相關的背景知識
-3. 引發思考的問題
-4. 實用的建議""",
-            
-            'mun': f"""你是一位經驗豐富的外交顧問和模擬聯合國專家。請針對以下議題提供專業分析：
-議題：{message}
-
-請提供：
-1. 國際法和外交角度的分析
-2. 各國立場和利益考量
-3. 可能的解決方案
-4. 談判策略建議"""
-        }
+    def _get_semaphore(self, provider: AIProvider) -> asyncio.Semaphore:
+        """取得提供商的限流號誌，事件迴圈改變時重新建立"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphores = {}
+            self._semaphore_loop = loop
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, 5))
+            self._semaphores[provider] = semaphore
+        return semaphore
+    
+    def _record_stats(self, provider: AIProvider, elapsed: float, is_error: Optional[bool]):
+        """更新提供商的延遲與錯誤率移動平均
         
-        return domain_prompts.get(domain, f"""請針對以下問題提供專業、詳細的回答：
-問題：{message}
-
-請確保回答準確、有用且易於理解。""")
+        is_error為None表示請求被取消：elapsed只是延遲的下限，僅在高於平均時用來調高延遲
+        """
+        elapsed_ms = elapsed * 1000
+        with self._stats_lock:
+            stats = self.stats[provider]
+            if is_error is None:
+                if elapsed_ms > stats['ewma_ms']:
+                    stats['ewma_ms'] = (1 - _LATENCY_EWMA_ALPHA) * stats['ewma_ms'] + _LATENCY_EWMA_ALPHA * elapsed_ms
+                return
+            deviation = abs(elapsed_ms - stats['ewma_ms'])
+            stats['dev_ms'] = (1 - _LATENCY_DEV_ALPHA) * stats['dev_ms'] + _LATENCY_DEV_ALPHA * deviation
+            stats['ewma_ms'] = (1 - _LATENCY_EWMA_ALPHA) * stats['ewma_ms'] + _LATENCY_EWMA_ALPHA * elapsed_ms
+            stats['err'] = (1 - _ERROR_EWMA_ALPHA) * stats['err'] + _ERROR_EWMA_ALPHA * is_error
+            if stats['err'] > _ERROR_COOLDOWN_THRESHOLD:
+                stats['cooldown_until'] = time.monotonic() + _ERROR_COOLDOWN_SECONDS
+    
+    def _hedge_delay(self, provider: AIProvider) -> float:
+        """對沖延遲（秒）：平均延遲加上數倍平均偏差，近似該提供商延遲的高百分位"""
+        with self._stats_lock:
+            stats = self.stats[provider]
+            delay_ms = stats['ewma_ms'] + _HEDGE_DEVIATION_FACTOR * stats['dev_ms']
+        return max(_HEDGE_MIN_DELAY, delay_ms / 1000)
+    
+    def _rank_providers(self, providers: List[AIProvider]) -> List[AIProvider]:
+        """依延遲與錯誤率排序提供商，略過冷卻中的提供商"""
+        now = time.monotonic()
+        with self._stats_lock:
+            scores = {
+                p: self.stats[p]['ewma_ms'] * (1 + _ERROR_PENALTY * self.stats[p]['err'])
+                for p in providers
+            }
+            healthy = [p for p in providers if self.stats[p]['cooldown_until'] <= now]
+        # 全部都在冷卻中時仍需嘗試，避免直接回傳備用回應
+        return sorted(healthy or providers, key=scores.__getitem__)
+    
+    @staticmethod
+    def _cache_key(message: str, domain: str) -> bytes:
+        """計算回應快取的鍵值"""
+        return hashlib.blake2b(f"{domain}\0{message}".encode('utf-8'), digest_size=16).digest()
+    
+    def _build_domain_prompt(self, message: str, domain: str) -> Tuple[str, str]:
+        """根據領域構建專業提示詞，回傳(固定的系統提示詞, 用戶提示詞)"""
+        system_prompt, label = DOMAIN_PROMPTS.get(domain, DEFAULT_PROMPT)
+        return system_prompt, f"{label}{message}"
     
     def _generate_intelligent_fallback(self, message: str, domain: str, error: Exception) -> AIResponse:
         """生成智能備用回應"""
-        fallback_responses = {
-            'math': f"我理解您的數學問題「{message}」。雖然目前無法提供完整的計算，但我建議您可以嘗試分解問題、查找相關公式，或使用數學工具來輔助解決。",
-            'programming': f"關於您的編程問題「{message}」，我建議您可以查閱官方文檔、搜索相關的代碼範例，或在開發者社群中尋求幫助。",
-            'writing': f"對於您的寫作需求「{message}」，我建議您可以先列出大綱、收集相關資料，並參考優秀的寫作範例來提升您的作品。",
-            'dialogue': f"關於「{message}」這個話題，這確實是一個值得深入討論的問題。我建議您可以從多個角度來思考，並歡迎進一步交流。",
-            'mun': f"關於「{message}」這個國際議題，建議您研究相關的國際法條文、各國官方立場，以及歷史先例來形成全面的分析。"
-        }
-        
-        content = fallback_responses.get(domain, f"感謝您的問題「{message}」。雖然目前遇到一些技術問題，但我會持續改進來為您提供更好的服務。")
+        prefix, suffix = FALLBACK_TEMPLATES.get(domain, DEFAULT_FALLBACK)
+        content = f"{prefix}{message}{suffix}"
         
         return AIResponse(
             content=content,
@@ -169,30 +524,30 @@ class OpenAIService:
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.base_url = "https://api.openai.com/v1/chat/completions"
         self.model = "gpt-3.5-turbo"
-    
-    async def generate(self, prompt: str, domain: str) -> AIResponse:
-        """使用OpenAI GPT生成回應"""
-        start_time = time.time()
-        
-        headers = {
+        self.confidence = 0.9
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
-        data = {
+    
+    def _build_payload(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": "你是一位專業、友善且知識豐富的AI助手。"},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
             ],
             "max_tokens": 1000,
             "temperature": 0.7
         }
+    
+    async def generate(self, system_prompt: str, user_prompt: str, domain: str) -> AIResponse:
+        """使用OpenAI GPT生成回應"""
+        start_time = time.time()
         
-        response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
+        data = self._build_payload(system_prompt, user_prompt)
         
-        result = response.json()
+        result = await _post_json(self.base_url, self.headers, data)
         content = result['choices'][0]['message']['content']
         tokens_used = result['usage']['total_tokens']
         
@@ -202,8 +557,19 @@ class OpenAIService:
             model=self.model,
             tokens_used=tokens_used,
             response_time=time.time() - start_time,
-            confidence=0.9
+            confidence=self.confidence
         )
+    
+    async def stream(self, system_prompt: str, user_prompt: str, domain: str) -> AsyncIterator[str]:
+        """以串流方式逐段產生OpenAI GPT回應"""
+        data = self._build_payload(system_prompt, user_prompt)
+        data["stream"] = True
+        
+        async for event in _stream_sse(self.base_url, self.headers, data):
+            choices = event.get('choices')
+            text = choices[0].get('delta', {}).get('content') if choices else None
+            if text:
+                yield text
 
 class AnthropicService:
     """Anthropic Claude服務"""
@@ -212,29 +578,32 @@ class AnthropicService:
         self.api_key = os.getenv('ANTHROPIC_API_KEY')
         self.base_url = "https://api.anthropic.com/v1/messages"
         self.model = "claude-3-sonnet-20240229"
-    
-    async def generate(self, prompt: str, domain: str) -> AIResponse:
-        """使用Anthropic Claude生成回應"""
-        start_time = time.time()
-        
-        headers = {
+        self.confidence = 0.95
+        self.headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json",
             "anthropic-version": "2023-06-01"
         }
-        
-        data = {
+    
+    def _build_payload(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "max_tokens": 1000,
+            "system": [
+                {"type": "text", "text": system_prompt, "cache_control": _ANTHROPIC_CACHE_CONTROL}
+            ],
             "messages": [
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": user_prompt}
             ]
         }
+    
+    async def generate(self, system_prompt: str, user_prompt: str, domain: str) -> AIResponse:
+        """使用Anthropic Claude生成回應"""
+        start_time = time.time()
         
-        response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
+        data = self._build_payload(system_prompt, user_prompt)
         
-        result = response.json()
+        result = await _post_json(self.base_url, self.headers, data)
         content = result['content'][0]['text']
         tokens_used = result['usage']['input_tokens'] + result['usage']['output_tokens']
         
@@ -244,8 +613,19 @@ class AnthropicService:
             model=self.model,
             tokens_used=tokens_used,
             response_time=time.time() - start_time,
-            confidence=0.95
+            confidence=self.confidence
         )
+    
+    async def stream(self, system_prompt: str, user_prompt: str, domain: str) -> AsyncIterator[str]:
+        """以串流方式逐段產生Anthropic Claude回應"""
+        data = self._build_payload(system_prompt, user_prompt)
+        data["stream"] = True
+        
+        async for event in _stream_sse(self.base_url, self.headers, data):
+            if event.get('type') == 'content_block_delta':
+                text = event['delta'].get('text')
+                if text:
+                    yield text
 
 class GoogleService:
     """Google Gemini服務"""
@@ -253,37 +633,46 @@ class GoogleService:
     def __init__(self):
         self.api_key = os.getenv('GOOGLE_API_KEY')
         self.base_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={self.api_key}"
+        self.stream_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:streamGenerateContent?alt=sse&key={self.api_key}"
+        self.model = "gemini-pro"
+        self.confidence = 0.85
+        self.headers = _JSON_HEADERS
     
-    async def generate(self, prompt: str, domain: str) -> AIResponse:
-        """使用Google Gemini生成回應"""
-        start_time = time.time()
-        
-        headers = {"Content-Type": "application/json"}
-        
-        data = {
+    def _build_payload(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+        return {
             "contents": [{
-                "parts": [{"text": prompt}]
+                "parts": [{"text": system_prompt}, {"text": user_prompt}]
             }],
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": 1000
-            }
+            "generationConfig": _GEMINI_GEN_CFG
         }
+    
+    async def generate(self, system_prompt: str, user_prompt: str, domain: str) -> AIResponse:
+        """使用Google Gemini生成回應"""
+        start_time = time.time()
         
-        response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
+        data = self._build_payload(system_prompt, user_prompt)
         
-        result = response.json()
+        result = await _post_json(self.base_url, self.headers, data)
         content = result['candidates'][0]['content']['parts'][0]['text']
         
         return AIResponse(
             content=content,
             provider="google",
-            model="gemini-pro",
+            model=self.model,
             tokens_used=len(content) // 4,  # 估算
             response_time=time.time() - start_time,
-            confidence=0.85
+            confidence=self.confidence
         )
+    
+    async def stream(self, system_prompt: str, user_prompt: str, domain: str) -> AsyncIterator[str]:
+        """以串流方式逐段產生Google Gemini回應"""
+        data = self._build_payload(system_prompt, user_prompt)
+        
+        async for event in _stream_sse(self.stream_url, self.headers, data):
+            for candidate in event.get('candidates', []):
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
 
 class HuggingFaceService:
     """Hugging Face免費服務（備用）"""
@@ -291,31 +680,91 @@ class HuggingFaceService:
     def __init__(self):
         self.base_url = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-large"
         self.api_key = os.getenv('HUGGINGFACE_API_KEY', '')
+        self.model = "DialoGPT-large"
+        self.confidence = 0.7
+        self.headers = dict(_JSON_HEADERS)
+        if self.api_key:
+            self.headers["Authorization"] = f"Bearer {self.api_key}"
+        # 微批次：短時間內的並行請求合併為一次推論呼叫
+        self._batch_queue: Optional[asyncio.Queue] = None
+        self._batch_worker: Optional[asyncio.Task] = None
+        self._batch_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight_batches = set()
     
-    async def generate(self, prompt: str, domain: str) -> AIResponse:
+    async def generate(self, system_prompt: str, user_prompt: str, domain: str) -> AIResponse:
         """使用Hugging Face模型生成回應"""
         start_time = time.time()
         
-        headers = {}
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        
-        data = {"inputs": prompt}
-        
-        response = requests.post(self.base_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        content = result[0]['generated_text'] if isinstance(result, list) else str(result)
+        content = await self._submit(f"{system_prompt}\n\n{user_prompt}")
         
         return AIResponse(
             content=content,
             provider="huggingface",
-            model="DialoGPT-large",
+            model=self.model,
             tokens_used=len(content) // 4,
             response_time=time.time() - start_time,
-            confidence=0.7
+            confidence=self.confidence
         )
+    
+    async def stream(self, system_prompt: str, user_prompt: str, domain: str) -> AsyncIterator[str]:
+        """推論API不支援串流，一次產生完整回應"""
+        response = await self.generate(system_prompt, user_prompt, domain)
+        yield response.content
+    
+    async def _submit(self, inputs: str) -> str:
+        """將輸入加入批次佇列並等待其結果"""
+        loop = asyncio.get_running_loop()
+        if self._batch_loop is not loop or self._batch_worker.done():
+            self._batch_queue = asyncio.Queue()
+            self._batch_worker = loop.create_task(self._run_batch_worker(self._batch_queue))
+            self._batch_loop = loop
+        
+        future = loop.create_future()
+        self._batch_queue.put_nowait((inputs, future))
+        return await future
+    
+    async def _run_batch_worker(self, queue: asyncio.Queue):
+        """收集批次時間窗內的請求，每批發出一次推論呼叫"""
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(_HF_BATCH_WINDOW)
+            while len(batch) < _HF_MAX_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            # 略過已被取消（例如對沖請求輸掉）的請求
+            batch = [(inputs, future) for inputs, future in batch if not future.done()]
+            if batch:
+                # 保留任務參考，避免執行中的任務被回收
+                task = asyncio.create_task(self._dispatch_batch(batch))
+                self._inflight_batches.add(task)
+                task.add_done_callback(self._inflight_batches.discard)
+    
+    async def _dispatch_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """發送批次推論請求並將結果分配回各個請求"""
+        try:
+            data = {"inputs": [inputs for inputs, _ in batch]}
+            result = await _post_json(self.base_url, self.headers, data)
+            if not isinstance(result, list) or len(result) != len(batch):
+                raise ValueError(f"批次推論回應格式不符: {str(result)[:200]}")
+            contents = [self._extract_text(item) for item in result]
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), content in zip(batch, contents):
+            if not future.done():
+                future.set_result(content)
+    
+    @staticmethod
+    def _extract_text(item: Any) -> str:
+        """取出單一輸入的生成文字"""
+        if isinstance(item, list) and item:
+            item = item[0]
+        if isinstance(item, dict) and 'generated_text' in item:
+            return item['generated_text']
+        return str(item)
 
 # 全域AI服務管理器實例
 ai_service = AIServiceManager()
\ No newline at end of file
@@ -3,21 +3,57 @@ AI聊天助手Web應用
 專注於多域AI對話功能
 """
 
-from flask import Flask, render_template, request, jsonify
-import torch
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
+import orjson
 import os
-import json
 import glob
+import time
+import atexit
 import asyncio
+import threading
+import concurrent.futures
 from datetime import datetime
-from ai_service import ai_service, AIProvider
+from ai_service import ai_service, AIProvider, close_session
+
+class OrJSONProvider(JSONProvider):
+    """使用orjson處理請求與回應的JSON序列化"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrJSONProvider(app)
 app.secret_key = 'ai_chat_secret_key'
 
 # 模型路徑配置
 MODELS_DIR = '../models/multi_domain'
 
+# 最新模型路徑快取：目錄修改時間未變時不重新掃描
+MODEL_CACHE_TTL = 5.0
+_MODEL_CACHE = {'path': None, 'mtime': 0, 'checked': float('-inf')}
+
+# 回應時間戳快取：(秒數, ISO字串)
+_TIMESTAMP_CACHE = (0, '')
+
+# AI回應的最長等待秒數
+AI_RESPONSE_TIMEOUT = 35
+
+# 共用的背景事件迴圈，讓連線池與限流狀態可跨請求保留
+BG_LOOP = asyncio.new_event_loop()
+threading.Thread(target=BG_LOOP.run_forever, name='ai-event-loop', daemon=True).start()
+
+@atexit.register
+def _stop_background_loop():
+    try:
+        asyncio.run_coroutine_threadsafe(close_session(), BG_LOOP).result(timeout=5)
+    except Exception:
+        pass
+    BG_LOOP.call_soon_threadsafe(BG_LOOP.stop)
+
 @app.route('/')
 def index():
     """主頁 - AI聊天界面"""
@@ -36,14 +72,21 @@ def chat():
         # 記錄用戶消息
         app.logger.info(f"用戶消息 [{domain}]: {user_message}")
         
-        # 使用異步方式生成AI回應
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # 串流模式：以SSE逐段傳送回應，縮短首字等待時間
+        if data.get('stream'):
+            return Response(
+                stream_with_context(stream_chat_events(user_message, domain)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
+        # 於背景事件迴圈中生成AI回應
+        future = asyncio.run_coroutine_threadsafe(generate_ai_response(user_message, domain), BG_LOOP)
         try:
-            ai_response = loop.run_until_complete(generate_ai_response(user_message, domain))
-        finally:
-            loop.close()
+            ai_response = future.result(timeout=AI_RESPONSE_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            ai_response = generate_enhanced_fallback_response(user_message, domain)
         
         # 記錄AI回應
         app.logger.info(f"AI回應: {ai_response[:100]}...")
@@ -52,7 +95,7 @@ def chat():
             'success': True,
             'response': ai_response,
             'domain': domain,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         })
         
     except Exception as e:
@@ -62,6 +105,52 @@ def chat():
             'error': f'處理請求時發生錯誤: {str(e)}'
         })
 
+def stream_chat_events(message, domain):
+    """將背景事件迴圈中的串流回應轉換為SSE事件"""
+    chunks = ai_service.stream_response(message, domain)
+    pending = {}
+    
+    async def next_chunk():
+        pending['task'] = asyncio.current_task()
+        return await chunks.__anext__()
+    
+    async def close_chunks():
+        # 產生器仍在等待下一段時無法直接關閉，需先取消該請求並等待其結束
+        task = pending.get('task')
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await chunks.aclose()
+    
+    received = []
+    try:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(next_chunk(), BG_LOOP)
+            try:
+                chunk = future.result(timeout=AI_RESPONSE_TIMEOUT)
+            except StopAsyncIteration:
+                break
+            except concurrent.futures.TimeoutError:
+                raise TimeoutError(f"AI回應逾時（超過{AI_RESPONSE_TIMEOUT}秒）") from None
+            received.append(chunk)
+            yield sse_event({'chunk': chunk})
+        
+        app.logger.info(f"AI回應: {''.join(received)[:100]}...")
+        yield sse_event({'done': True, 'domain': domain, 'timestamp': now_iso()})
+    except Exception as e:
+        app.logger.error(f"串流回應錯誤: {str(e)}")
+        if not received:
+            yield sse_event({'chunk': generate_enhanced_fallback_response(message, domain)})
+        yield sse_event({'done': True, 'error': str(e), 'domain': domain,
+                         'timestamp': now_iso()})
+    finally:
+        # 客戶端中斷或逾時時取消進行中的請求並關閉產生器，釋放提供商連線與號誌
+        asyncio.run_coroutine_threadsafe(close_chunks(), BG_LOOP)
+
+def sse_event(payload):
+    """格式化單一SSE事件"""
+    return f"data: {orjson.dumps(payload).decode('utf-8')}\n\n"
+
 async def generate_ai_response(message, domain):
     """使用先進AI模型生成回應"""
     try:
@@ -78,20 +167,39 @@ async def generate_ai_response(message, domain):
         print(f"AI回應生成錯誤: {str(e)}")
         return generate_enhanced_fallback_response(message, domain)
 
+def now_iso():
+    """取得目前時間的ISO字串（秒級精度，同一秒內重用已格式化的結果）"""
+    global _TIMESTAMP_CACHE
+    second = int(time.time())
+    cached_second, cached_value = _TIMESTAMP_CACHE
+    if second != cached_second:
+        cached_value = datetime.fromtimestamp(second).isoformat()
+        # 以單一元組替換，讓其他執行緒不會讀到不一致的秒數與字串
+        _TIMESTAMP_CACHE = (second, cached_value)
+    return cached_value
+
 def get_latest_model_path():
-    """獲取最新的模型路徑"""
+    """獲取最新的模型路徑（短時間內重用結果，目錄未變更時不重新掃描）"""
+    now = time.monotonic()
+    if now - _MODEL_CACHE['checked'] < MODEL_CACHE_TTL:
+        return _MODEL_CACHE['path']
+    
     try:
-        model_files = glob.glob(os.path.join(MODELS_DIR, 'multi_domain_model_*.pth'))
-        if not model_files:
-            return None
-        return max(model_files, key=os.path.getctime)
+        mtime = os.stat(MODELS_DIR).st_mtime
+        if mtime != _MODEL_CACHE['mtime']:
+            model_files = glob.glob(os.path.join(MODELS_DIR, 'multi_domain_model_*.pth'))
+            _MODEL_CACHE['path'] = max(model_files, key=os.path.getctime) if model_files else None
+            _MODEL_CACHE['mtime'] = mtime
     except:
-        return None
+        _MODEL_CACHE['path'] = None
+        _MODEL_CACHE['mtime'] = 0
+    
+    _MODEL_CACHE['checked'] = now
+    return _MODEL_CACHE['path']
 
-def generate_enhanced_fallback_response(message, domain):
-    """生成增強的備用回應"""
-    enhanced_responses = {
-        'math': f"""數學專家助手：關於您的問題「{message}」
+# 增強備用回應：(訊息前的文字, 訊息後的文字)
+ENHANCED_FALLBACK_TEMPLATES = {
+    'math': ("數學專家助手：關於您的問題「", """」
 
 我來為您提供數學方面的幫助：
 • 如果是計算問題，我建議您檢查數字和運算符號
@@ -99,9 +207,9 @@ def generate_enhanced_fallback_response(message, domain):
 • 對於複雜問題，建議分步驟解決
 • 您也可以使用數學工具如計算器、圖形軟體等輔助
 
-需要更具體的幫助嗎？請提供更多詳細資訊。""",
+需要更具體的幫助嗎？請提供更多詳細資訊。"""),
 
-        'programming': f"""程式設計專家：關於您的編程問題「{message}」
+    'programming': ("程式設計專家：關於您的編程問題「", """」
 
 讓我為您提供編程建議：
 • 檢查語法和邏輯錯誤
@@ -110,9 +218,9 @@ def generate_enhanced_fallback_response(message, domain):
 • 使用除錯工具逐步檢查
 • 考慮代碼的可讀性和效能
 
-如需更詳細的協助，請分享您的代碼片段。""",
+如需更詳細的協助，請分享您的代碼片段。"""),
 
-        'writing': f"""寫作指導專家：關於您的寫作需求「{message}」
+    'writing': ("寫作指導專家：關於您的寫作需求「", """」
 
 我來協助您提升寫作品質：
 • 明確寫作目的和目標讀者
@@ -121,9 +229,9 @@ def generate_enhanced_fallback_response(message, domain):
 • 注意語法、標點和用詞準確性
 • 多次修改和潤色您的作品
 
-需要針對特定寫作類型的建議嗎？""",
+需要針對特定寫作類型的建議嗎？"""),
 
-        'dialogue': f"""智慧對話夥伴：關於「{message}」這個話題
+    'dialogue': ("智慧對話夥伴：關於「", """」這個話題
 
 這確實是個值得深入探討的問題：
 • 讓我們從不同角度來分析
@@ -132,9 +240,9 @@ def generate_enhanced_fallback_response(message, domain):
 • 分享相關的經驗和見解
 • 提出進一步思考的問題
 
-您希望從哪個方面開始討論呢？""",
+您希望從哪個方面開始討論呢？"""),
 
-        'mun': f"""模擬聯合國專家：關於國際議題「{message}」
+    'mun': ("模擬聯合國專家：關於國際議題「", """」
 
 作為您的外交顧問，我建議：
 • 研究相關的國際法和條約
@@ -143,10 +251,10 @@ def generate_enhanced_fallback_response(message, domain):
 • 評估可能的談判策略
 • 準備多種解決方案選項
 
-需要針對特定國家立場或程序的建議嗎？"""
-    }
-    
-    return enhanced_responses.get(domain, f"""AI智慧助手：感謝您的問題「{message}」
+需要針對特定國家立場或程序的建議嗎？""")
+}
+
+DEFAULT_ENHANCED_FALLBACK = ("AI智慧助手：感謝您的問題「", """」
 
 雖然目前遇到一些技術限制，但我仍想為您提供幫助：
 • 這是一個很有意思的問題
@@ -156,6 +264,11 @@ def generate_enhanced_fallback_response(message, domain):
 
 有什麼其他我可以協助的嗎？""")
 
+def generate_enhanced_fallback_response(message, domain):
+    """生成增強的備用回應"""
+    prefix, suffix = ENHANCED_FALLBACK_TEMPLATES.get(domain, DEFAULT_ENHANCED_FALLBACK)
+    return f"{prefix}{message}{suffix}"
+
 if __name__ == '__main__':
     print("AI聊天助手啟動中...")
     print("訪問地址: http://localhost:5001")
@@ -6,8 +6,15 @@
 
 import os
 import sys
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from training_data_manager import training_manager
 
+def example_digest(example) -> bytes:
+    """計算訓練範例內容的128位元摘要，作為去重鍵值"""
+    key = f"{example.domain}\0{example.user_input}\0{example.ai_response}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
 def main():
     """主函數 - 生成訓練數據"""
     print("🚀 開始生成AI訓練數據集...")
@@ -25,40 +32,59 @@ def main():
         print(f"📈 每個領域將生成約 {examples_per_domain} 個範例")
         print()
         
-        all_training_data = training_manager.generate_comprehensive_dataset(
-            domains=domains,
-            examples_per_domain=examples_per_domain
-        )
+        # 各領域互不相依，以多個行程並行生成；每個領域完成後立即保存其分片，
+        # 並在同一次走訪中累計統計，不再對全部數據重複掃描
+        domain_results = {}
+        domain_stats = {}
+        seen = set()
+        duplicate_count = 0
+        print("💾 按領域保存數據...")
+        with ProcessPoolExecutor(max_workers=min(len(domains), os.cpu_count() or 1)) as executor:
+            futures = {
+                executor.submit(training_manager.generate_domain_dataset, domain, examples_per_domain): domain
+                for domain in domains
+            }
+            for future in as_completed(futures):
+                domain = futures[future]
+                
+                # 去除完全重複的範例
+                domain_examples = []
+                for example in future.result():
+                    digest = example_digest(example)
+                    if digest in seen:
+                        duplicate_count += 1
+                        continue
+                    seen.add(digest)
+                    domain_examples.append(example)
+                
+                domain_results[domain] = domain_examples
+                domain_stats[domain] = len(domain_examples)
+                
+                domain_filename = f"{domain}_training_data.json"
+                training_manager.save_training_data(domain_examples, domain_filename)
+                print(f"  • {domain}: {len(domain_examples)} 個範例 → {domain_filename}")
+        
+        # 完成順序每次不同，合併時一律依領域順序
+        all_training_data = [example for domain in domains for example in domain_results[domain]]
+        high_quality_data = [
+            example for domain in domains
+            for example in training_manager.filter_by_quality(domain_results[domain], min_score=0.8)
+        ]
         
         print()
         print("=" * 50)
-        print(f"✅ 總共生成了 {len(all_training_data)} 個訓練範例")
-        
-        # 按領域統計
-        domain_stats = {}
-        for example in all_training_data:
-            domain = example.domain
-            domain_stats[domain] = domain_stats.get(domain, 0) + 1
+        print(f"✅ 總共生成了 {len(all_training_data)} 個訓練範例（已去除 {duplicate_count} 個重複範例）")
         
         print("\n📊 各領域數據統計:")
-        for domain, count in domain_stats.items():
-            print(f"  • {domain}: {count} 個範例")
+        for domain in domains:
+            print(f"  • {domain}: {domain_stats[domain]} 個範例")
         
         # 保存訓練數據
         filename = "comprehensive_training_data.json"
         training_manager.save_training_data(all_training_data, filename)
         
-        # 按領域分別保存
-        print("\n💾 按領域保存數據...")
-        for domain in domains:
-            domain_examples = [ex for ex in all_training_data if ex.domain == domain]
-            domain_filename = f"{domain}_training_data.json"
-            training_manager.save_training_data(domain_examples, domain_filename)
-            print(f"  • {domain}: {len(domain_examples)} 個範例 → {domain_filename}")
-        
-        # 生成高品質數據集
+        # 保存高品質數據集
         print("\n🌟 生成高品質數據集...")
-        high_quality_data = training_manager.filter_by_quality(all_training_data, min_score=0.8)
         high_quality_filename = "high_quality_training_data.json"
         training_manager.save_training_data(high_quality_data, high_quality_filename)
         print(f"  • 高品質數據: {len(high_quality_data)} 個範例 → {high_quality_filename}")
@@ -4,12 +4,59 @@ AI模型優化器
 使用生成的訓練資料進行模型微調和優化
 """
 
-import json
 import os
+import orjson
+import aiofiles
+import re
+import time
+import random
 import asyncio
-from typing import List, Dict, Any
+import itertools
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
 from training_data_manager import TrainingExample, training_manager
-from ai_service import ai_service
+from ai_service import ai_service, close_session
+
+# 非字母數字且非空白的字元（\w包含底線，因此另外列出）
+_SPECIAL_CHAR_RE = re.compile(r'[^\w\s]|_')
+
+# 評估時同時進行的AI請求數上限
+EVAL_CONCURRENCY = 16
+
+# 每次評估抽樣的範例數（依領域比例分層抽樣）
+EVAL_SAMPLE_SIZE = 50
+
+# 平行載入訓練檔案的執行緒數上限
+LOAD_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+def _load_file(path: str) -> List[TrainingExample]:
+    """載入單一訓練檔案；失敗時只略過該檔案，不影響其他檔案"""
+    name = os.path.basename(path)
+    try:
+        data = training_manager.load_training_file(path)
+    except Exception as e:
+        print(f"❌ 載入 {name} 失敗: {str(e)}")
+        return []
+    print(f"✅ 載入 {name}: {len(data)} 個範例")
+    return data
+
+@lru_cache(maxsize=20000)
+def _expected_features(expected: str) -> Tuple[frozenset, int]:
+    """預期回應的詞彙集合與長度；同一回應在多次評估間重用"""
+    return frozenset(expected.lower().split()), len(expected)
+
+@lru_cache(maxsize=128)
+def _config_for(domain: str, complexity: float, max_tokens: int) -> Dict[str, Any]:
+    """依量化後的領域統計產生參數配置；呼叫端需複製回傳值再修改"""
+    return {
+        'temperature': round(max(0.1, min(1.0, complexity / 10.0)), 2),
+        'max_tokens': max_tokens,
+        'top_p': 0.9 if complexity > 6 else 0.8,
+        'frequency_penalty': 0.1 if domain == 'writing' else 0.0
+    }
 
 class ModelOptimizer:
     def __init__(self):
@@ -24,14 +71,12 @@ class ModelOptimizer:
             print("❌ 訓練資料目錄不存在")
             return all_data
             
-        for filename in os.listdir(self.training_data_dir):
-            if filename.endswith('.json'):
-                try:
-                    data = training_manager.load_training_data(filename)
-                    all_data.extend(data)
-                    print(f"✅ 載入 {filename}: {len(data)} 個範例")
-                except Exception as e:
-                    print(f"❌ 載入 {filename} 失敗: {str(e)}")
+        with os.scandir(self.training_data_dir) as entries:
+            paths = [entry.path for entry in entries if entry.name.endswith('.json')]
+        
+        with ThreadPoolExecutor(max_workers=LOAD_MAX_WORKERS) as executor:
+            results = list(executor.map(_load_file, paths))
+        all_data = list(itertools.chain.from_iterable(results))
         
         print(f"\n📊 總共載入 {len(all_data)} 個訓練範例")
         return all_data
@@ -40,43 +85,37 @@ class ModelOptimizer:
         """評估模型性能"""
         print("\n🔍 評估模型性能...")
         
+        examples = self._stratified_sample(test_examples, EVAL_SAMPLE_SIZE)
+        semaphore = asyncio.Semaphore(EVAL_CONCURRENCY)
+        
+        async def evaluate_one(example: TrainingExample):
+            async with semaphore:
+                return example.domain, await self._evaluate_example(example)
+        
+        # 並行評估所有範例，以號誌限制同時進行的請求數
+        results = await asyncio.gather(*[evaluate_one(e) for e in examples], return_exceptions=True)
+        
         correct_predictions = 0
-        total_predictions = len(test_examples)
         domain_performance = {}
-        
-        for i, example in enumerate(test_examples[:50]):  # 測試前50個範例
-            try:
-                # 使用AI服務生成回應
-                response = await ai_service.generate_response(
-                    message=example.user_input,
-                    domain=example.domain
-                )
-                
-                # 簡單的性能評估（基於回應長度和關鍵詞匹配）
-                is_good_response = self._evaluate_response_quality(
-                    example.ai_response, 
-                    response.content if hasattr(response, 'content') else str(response)
-                )
-                
-                if is_good_response:
-                    correct_predictions += 1
-                
-                # 按領域統計
-                if example.domain not in domain_performance:
-                    domain_performance[example.domain] = {'correct': 0, 'total': 0}
-                
-                domain_performance[example.domain]['total'] += 1
-                if is_good_response:
-                    domain_performance[example.domain]['correct'] += 1
-                
-                if (i + 1) % 10 == 0:
-                    print(f"  進度: {i + 1}/50")
-                    
-            except Exception as e:
-                print(f"  評估範例 {i+1} 時發生錯誤: {str(e)}")
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                print(f"  評估範例 {i+1} 時發生錯誤: {str(result)}")
+                continue
+            
+            domain, is_good_response = result
+            if is_good_response:
+                correct_predictions += 1
+            
+            # 按領域統計
+            if domain not in domain_performance:
+                domain_performance[domain] = {'correct': 0, 'total': 0}
+            
+            domain_performance[domain]['total'] += 1
+            if is_good_response:
+                domain_performance[domain]['correct'] += 1
         
         # 計算整體準確率
-        overall_accuracy = correct_predictions / min(50, total_predictions) if total_predictions > 0 else 0
+        overall_accuracy = correct_predictions / len(examples) if examples else 0
         
         # 計算各領域準確率
         domain_accuracies = {}
@@ -86,26 +125,69 @@ class ModelOptimizer:
         results = {
             'overall_accuracy': overall_accuracy,
             'domain_accuracies': domain_accuracies,
-            'total_evaluated': min(50, total_predictions)
+            'total_evaluated': len(examples)
         }
         
         return results
     
+    def _stratified_sample(self, examples: List[TrainingExample], sample_size: int) -> List[TrainingExample]:
+        """依領域比例分層抽樣，避免資料依領域排序時部分領域完全未被評估"""
+        if len(examples) <= sample_size:
+            return list(examples)
+        
+        by_domain = defaultdict(list)
+        for example in examples:
+            by_domain[example.domain].append(example)
+        
+        # 按比例分配名額；餘下名額先保證每個領域至少一個，再給小數部分最大的領域
+        total = len(examples)
+        shares = {domain: len(group) * sample_size / total for domain, group in by_domain.items()}
+        quotas = {domain: int(share) for domain, share in shares.items()}
+        remaining = sample_size - sum(quotas.values())
+        candidates = sorted(shares, key=lambda d: (quotas[d] > 0, quotas[d] - shares[d]))
+        for domain in candidates[:remaining]:
+            quotas[domain] += 1
+        
+        sample = []
+        for domain, group in by_domain.items():
+            sample.extend(random.sample(group, quotas[domain]))
+        return sample
+    
+    async def _evaluate_example(self, example: TrainingExample) -> bool:
+        """評估單一範例的回應品質"""
+        # 使用AI服務生成回應
+        response = await ai_service.generate_response(
+            message=example.user_input,
+            domain=example.domain
+        )
+        
+        # 簡單的性能評估（基於回應長度和關鍵詞匹配）
+        return self._evaluate_response_quality(
+            example.ai_response, 
+            response.content if hasattr(response, 'content') else str(response)
+        )
+    
     def _evaluate_response_quality(self, expected: str, actual: str) -> bool:
         """評估回應品質"""
-        if not actual or len(actual.strip()) < 10:
+        # 先做不需斷詞的檢查：過短的回應直接不合格，只有首尾為空白時才需要strip
+        if not actual or len(actual) < 10:
+            return False
+        if (actual[0].isspace() or actual[-1].isspace()) and len(actual.strip()) < 10:
+            return False
+        # 預期回應為空時評分固定為0.2，必定不合格
+        if not expected:
             return False
         
         # 基本品質檢查
-        expected_words = set(expected.lower().split())
+        expected_words, expected_length = _expected_features(expected)
         actual_words = set(actual.lower().split())
         
         # 計算詞彙重疊率
-        overlap = len(expected_words.intersection(actual_words))
+        overlap = len(expected_words & actual_words)
         overlap_ratio = overlap / len(expected_words) if expected_words else 0
         
         # 長度檢查
-        length_ratio = len(actual) / len(expected) if expected else 1
+        length_ratio = len(actual) / expected_length if expected_length else 1
         
         # 綜合評分
         quality_score = (overlap_ratio * 0.6) + (min(length_ratio, 2.0) / 2.0 * 0.4)
@@ -116,33 +198,26 @@ class ModelOptimizer:
         """優化模型參數"""
         print("\n⚙️ 優化模型參數...")
         
-        # 分析訓練資料特徵
-        domain_stats = {}
-        for example in training_data:
-            domain = example.domain
-            if domain not in domain_stats:
-                domain_stats[domain] = {
-                    'count': 0,
-                    'avg_input_length': 0,
-                    'avg_output_length': 0,
-                    'complexity_scores': []
-                }
-            
-            stats = domain_stats[domain]
-            stats['count'] += 1
-            stats['avg_input_length'] += len(example.user_input)
-            stats['avg_output_length'] += len(example.ai_response)
-            
-            # 計算複雜度分數
-            complexity = self._calculate_complexity(example.user_input)
-            stats['complexity_scores'].append(complexity)
+        arrays = training_manager.to_arrays(training_data)
+        # 一次計算所有輸入的複雜度
+        complexities = self._calculate_complexity_batch([e.user_input for e in training_data])
         
-        # 計算平均值
-        for domain, stats in domain_stats.items():
-            if stats['count'] > 0:
-                stats['avg_input_length'] /= stats['count']
-                stats['avg_output_length'] /= stats['count']
-                stats['avg_complexity'] = sum(stats['complexity_scores']) / len(stats['complexity_scores'])
+        # 分析訓練資料特徵：依領域分組後以bincount一次加總
+        labels, first_index, inverse = np.unique(arrays['domain'], return_index=True, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(labels)).tolist()
+        sum_in = np.bincount(inverse, weights=arrays['input_len'], minlength=len(labels)).tolist()
+        sum_out = np.bincount(inverse, weights=arrays['output_len'], minlength=len(labels)).tolist()
+        sum_complexity = np.bincount(inverse, weights=complexities, minlength=len(labels)).tolist()
+        
+        # 依領域首次出現的順序輸出
+        domain_stats = {}
+        for i in np.argsort(first_index).tolist():
+            domain_stats[labels[i]] = {
+                'count': counts[i],
+                'sum_in': sum_in[i],
+                'sum_out': sum_out[i],
+                'sum_complexity': sum_complexity[i]
+            }
         
         # 基於統計資料調整AI服務參數
         optimization_config = self._generate_optimization_config(domain_stats)
@@ -155,19 +230,34 @@ class ModelOptimizer:
     
     def _calculate_complexity(self, text: str) -> float:
         """計算文本複雜度"""
-        words = text.split()
-        sentences = text.split('.')
+        return float(self._calculate_complexity_batch([text])[0])
+    
+    def _calculate_complexity_batch(self, texts: List[str]) -> np.ndarray:
+        """批次計算文本複雜度，逐字處理交給C實作的字串方法，其餘以向量運算完成"""
+        n = len(texts)
+        lengths = np.fromiter(map(len, texts), dtype=np.float64, count=n)
+        word_counts = np.empty(n)
+        word_chars = np.empty(n)
+        sentence_words = np.empty(n)
+        special_chars = np.empty(n)
+        for i, text in enumerate(texts):
+            words = text.split()
+            word_counts[i] = len(words)
+            word_chars[i] = len(''.join(words))
+            # 各句（以'.'分隔）的詞數總和
+            sentence_words[i] = len(text.replace('.', ' ').split())
+            special_chars[i] = len(_SPECIAL_CHAR_RE.findall(text))
+        sentence_counts = np.fromiter((text.count('.') + 1 for text in texts), dtype=np.float64, count=n)
         
         # 基本複雜度指標
-        avg_word_length = sum(len(word) for word in words) / len(words) if words else 0
-        avg_sentence_length = sum(len(sentence.split()) for sentence in sentences) / len(sentences) if sentences else 0
+        avg_word_length = np.divide(word_chars, word_counts, out=np.zeros(n), where=word_counts > 0)
+        avg_sentence_length = sentence_words / sentence_counts
         
         # 特殊字符和數字的比例
-        special_chars = sum(1 for char in text if not char.isalnum() and not char.isspace())
-        special_ratio = special_chars / len(text) if text else 0
+        special_ratio = np.divide(special_chars, lengths, out=np.zeros(n), where=lengths > 0)
         
         complexity = (avg_word_length * 0.3) + (avg_sentence_length * 0.5) + (special_ratio * 100 * 0.2)
-        return min(complexity, 10.0)  # 限制在0-10範圍內
+        return np.minimum(complexity, 10.0)  # 限制在0-10範圍內
     
     def _generate_optimization_config(self, domain_stats: Dict) -> Dict[str, Dict]:
         """生成優化配置"""
@@ -175,14 +265,14 @@ class ModelOptimizer:
         
         for domain, stats in domain_stats.items():
             # 基於統計資料調整參數
-            complexity = stats.get('avg_complexity', 5.0)
+            count = stats['count']
+            complexity = stats['sum_complexity'] / count if count else 5.0
+            avg_output_length = stats['sum_out'] / count if count else 0
             
-            domain_config = {
-                'temperature': max(0.1, min(1.0, complexity / 10.0)),
-                'max_tokens': int(stats['avg_output_length'] * 1.2) if stats['avg_output_length'] > 0 else 500,
-                'top_p': 0.9 if complexity > 6 else 0.8,
-                'frequency_penalty': 0.1 if domain == 'writing' else 0.0
-            }
+            max_tokens = int(avg_output_length * 1.2) if avg_output_length > 0 else 500
+            
+            # 複雜度量化到小數一位，讓相近的統計共用快取的配置
+            domain_config = dict(_config_for(domain, round(complexity, 1), max_tokens))
             
             config[domain] = domain_config
         
@@ -200,7 +290,7 @@ class ModelOptimizer:
             return
         
         # 2. 評估當前模型性能
-        test_data = training_data[:100]  # 使用前100個作為測試集
+        test_data = training_data  # 評估時按領域分層抽樣
         performance = await self.evaluate_model_performance(test_data)
         
         print(f"\n📊 模型性能評估結果:")
@@ -216,29 +306,29 @@ class ModelOptimizer:
         
         # 4. 保存優化結果
         results = {
-            'timestamp': asyncio.get_event_loop().time(),
+            'timestamp': time.time(),
             'performance': performance,
             'optimization_config': optimization_config,
             'training_data_count': len(training_data)
         }
         
-        self._save_optimization_results(results)
+        await self._save_optimization_results(results)
         
         print("\n✅ 模型優化完成！")
         print("💡 建議定期重新執行優化以持續改善模型性能")
         
         return results
     
-    def _save_optimization_results(self, results: Dict):
+    async def _save_optimization_results(self, results: Dict):
         """保存優化結果"""
         results_dir = "./optimization_results"
         os.makedirs(results_dir, exist_ok=True)
         
-        filename = f"optimization_results_{int(asyncio.get_event_loop().time())}.json"
+        filename = f"optimization_results_{int(results['timestamp'])}.json"
         filepath = os.path.join(results_dir, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        async with aiofiles.open(filepath, 'wb') as f:
+            await f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
         
         print(f"\n💾 優化結果已保存到: {filepath}")
 
@@ -247,7 +337,10 @@ model_optimizer = ModelOptimizer()
 
 async def main():
     """主函數"""
-    await model_optimizer.run_optimization()
+    try:
+        await model_optimizer.run_optimization()
+    finally:
+        await close_session()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+語義快取模組 - 以句向量相似度重用近似問題的AI回應
+精確快取無法命中改寫過的問題，此層以餘弦相似度比對同領域的歷史問題
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # 未安裝時停用語義快取
+    SentenceTransformer = None
+
+# 多語言模型，可處理中文與英文混合的問題
+DEFAULT_MODEL_NAME = os.getenv('SEMANTIC_CACHE_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')
+DEFAULT_THRESHOLD = 0.92
+# 數字稍有不同答案就不同的領域需要更嚴格的門檻
+DOMAIN_THRESHOLDS = {
+    'math': 0.97,
+    'programming': 0.95
+}
+MAX_ENTRIES_PER_DOMAIN = 10_000
+_INITIAL_CAPACITY = 256
+
+class _DomainBucket:
+    """單一領域的向量與回應儲存（先進先出淘汰）"""
+
+    def __init__(self, dim: int, max_entries: int):
+        self.max_entries = max_entries
+        self.embeddings = np.zeros((min(_INITIAL_CAPACITY, max_entries), dim), dtype=np.float32)
+        self.values: List[Any] = []
+        self.next_index = 0
+
+    def lookup(self, query: np.ndarray, threshold: float) -> Optional[Any]:
+        size = len(self.values)
+        if not size:
+            return None
+        sims = self.embeddings[:size] @ query
+        best = int(np.argmax(sims))
+        return self.values[best] if sims[best] > threshold else None
+
+    def add(self, embedding: np.ndarray, value: Any):
+        size = len(self.values)
+        if size < self.max_entries:
+            if size == len(self.embeddings):
+                grown = np.zeros((min(size * 2, self.max_entries), self.embeddings.shape[1]),
+                                 dtype=np.float32)
+                grown[:size] = self.embeddings
+                self.embeddings = grown
+            self.embeddings[size] = embedding
+            self.values.append(value)
+            return
+
+        # 已滿時覆寫最舊的項目
+        self.embeddings[self.next_index] = embedding
+        self.values[self.next_index] = value
+        self.next_index = (self.next_index + 1) % self.max_entries
+
+class SemanticCache:
+    """以句向量相似度查找近似問題的快取"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME,
+                 max_entries: int = MAX_ENTRIES_PER_DOMAIN,
+                 thresholds: Optional[Dict[str, float]] = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.thresholds = DOMAIN_THRESHOLDS if thresholds is None else thresholds
+        self._model = None
+        self._model_failed = not model_name or SentenceTransformer is None
+        self._model_lock = threading.Lock()
+        self._buckets: Dict[str, _DomainBucket] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return not self._model_failed
+
+    def _get_model(self):
+        """延遲載入句向量模型，避免拖慢應用啟動"""
+        with self._model_lock:
+            if self._model is None and not self._model_failed:
+                try:
+                    self._model = SentenceTransformer(self.model_name)
+                except Exception as e:
+                    print(f"語義快取模型載入失敗，已停用: {str(e)}")
+                    self._model_failed = True
+            return self._model
+
+    def encode(self, message: str) -> Optional[np.ndarray]:
+        """計算正規化後的句向量，模型不可用時回傳None"""
+        model = self._get_model()
+        if model is None:
+            return None
+        return model.encode(message, normalize_embeddings=True).astype(np.float32, copy=False)
+
+    def lookup(self, domain: str, embedding: np.ndarray) -> Optional[Any]:
+        """查找相似度超過領域門檻的快取值"""
+        threshold = self.thresholds.get(domain, DEFAULT_THRESHOLD)
+        with self._lock:
+            bucket = self._buckets.get(domain)
+            return bucket.lookup(embedding, threshold) if bucket else None
+
+    def add(self, domain: str, embedding: np.ndarray, value: Any):
+        """加入新的快取項目"""
+        with self._lock:
+            bucket = self._buckets.get(domain)
+            if bucket is None:
+                bucket = _DomainBucket(len(embedding), self.max_entries)
+                self._buckets[domain] = bucket
+            bucket.add(embedding, value)
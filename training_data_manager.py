@@ -4,16 +4,182 @@
 """
 
 import os
-import json
+import re
+import sys
 import csv
+import orjson
+import aiofiles
+import numpy as np
 import requests
 import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Tuple
+from dataclasses import dataclass, field
 import random
+import threading
+from collections import Counter, OrderedDict
 
-@dataclass
+# 已解析檔案的快取上限，以(路徑, 修改時間)為鍵，檔案未變動時免重新解析
+_LOAD_CACHE_SIZE = 64
+_READ_BUFFER_SIZE = 1 << 20
+
+# Python 3.10以上以slots省去每個實例的__dict__，大型語料可明顯降低記憶體用量
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# 各領域的合成數據模板（模組層級常數，避免每次呼叫重建）
+DOMAIN_TEMPLATES = {
+    'math': (
+        {
+            'id': 'calculation',
+            'user_patterns': (
+                "計算 {expression}",
+                "幫我算一下 {expression}",
+                "{expression} 等於多少？",
+                "求解 {expression}"
+            ),
+            'expressions': (
+                "2 + 3 × 4", "√16 + 5²", "sin(30°)", "log₂(8)",
+                "∫x²dx", "lim(x→0) sin(x)/x", "3x + 5 = 14"
+            )
+        },
+        {
+            'id': 'concept',
+            'user_patterns': (
+                "什麼是{concept}？",
+                "解釋一下{concept}",
+                "{concept}的定義是什麼？",
+                "如何理解{concept}？"
+            ),
+            'concepts': (
+                "微積分", "線性代數", "機率論", "統計學",
+                "幾何學", "三角函數", "複數", "矩陣"
+            )
+        }
+    ),
+    'programming': (
+        {
+            'id': 'coding_problem',
+            'user_patterns': (
+                "如何用{language}實現{task}？",
+                "寫一個{language}程式來{task}",
+                "{language}中如何{task}？",
+                "幫我寫{task}的代碼"
+            ),
+            'languages': ('Python', 'JavaScript', 'Java', 'C++', 'Go'),
+            'tasks': (
+                '排序陣列', '搜尋元素', '計算階乘', '反轉字串',
+                '檢查回文', '生成斐波那契數列', '實現二分搜尋'
+            )
+        },
+        {
+            'id': 'debugging',
+            'user_patterns': (
+                "這段代碼有什麼問題？{code}",
+                "為什麼我的程式不工作？{code}",
+                "幫我除錯：{code}",
+                "修復這個錯誤：{code}"
+            ),
+            'code_snippets': (
+                "for i in range(10) print(i)",
+                "def factorial(n): return n * factorial(n-1)",
+                "list = [1,2,3]; list.append(4); print(list[4])"
+            )
+        }
+    ),
+    'writing': (
+        {
+            'id': 'creative_writing',
+            'user_patterns': (
+                "幫我寫一篇關於{topic}的{type}",
+                "創作一個{genre}故事，主題是{topic}",
+                "寫一段{type}，描述{topic}",
+                "給我一個{topic}的{type}範例"
+            ),
+            'topics': ('友情', '冒險', '科技', '自然', '夢想', '成長'),
+            'types': ('短文', '詩歌', '故事', '散文', '日記'),
+            'genres': ('科幻', '奇幻', '懸疑', '愛情', '歷史')
+        },
+    ),
+    'dialogue': (
+        {
+            'id': 'general_chat',
+            'user_patterns': (
+                "你覺得{topic}怎麼樣？",
+                "我們來聊聊{topic}吧",
+                "關於{topic}，你有什麼看法？",
+                "談談你對{topic}的想法"
+            ),
+            'topics': (
+                '人工智慧的未來', '環保議題', '教育改革', '科技發展',
+                '文化差異', '生活哲學', '職業規劃', '健康生活'
+            )
+        },
+    ),
+    'mun': (
+        {
+            'id': 'diplomatic_analysis',
+            'user_patterns': (
+                "分析{country}在{issue}上的立場",
+                "{issue}的國際法依據是什麼？",
+                "如何解決{issue}問題？",
+                "{country}應該如何應對{issue}？"
+            ),
+            'countries': ('美國', '中國', '俄羅斯', '德國', '日本', '印度'),
+            'issues': (
+                '氣候變遷', '核武擴散', '貿易爭端', '難民危機',
+                '網路安全', '太空軍備', '海洋權益', '人權問題'
+            )
+        },
+    )
+}
+
+# 各領域的合成AI回應開頭
+RESPONSE_TEMPLATES = {
+    'math': (
+        "讓我來幫您解決這個數學問題。首先，我們需要...",
+        "這是一個很好的數學問題。根據相關定理...",
+        "我來為您詳細計算這個問題的步驟..."
+    ),
+    'programming': (
+        "這是一個常見的編程問題。讓我為您提供解決方案...",
+        "我來幫您分析這段代碼並提供改進建議...",
+        "這個問題可以用以下方法解決..."
+    ),
+    'writing': (
+        "我很樂意幫您創作。讓我們從以下角度開始...",
+        "這是一個很有創意的寫作主題。我建議...",
+        "讓我為您提供一些寫作靈感和結構建議..."
+    ),
+    'dialogue': (
+        "這是一個很有趣的話題。從我的角度來看...",
+        "關於這個問題，我認為我們可以從多個層面來討論...",
+        "這確實是值得深入思考的議題..."
+    ),
+    'mun': (
+        "從國際法的角度來分析這個問題...",
+        "根據聯合國憲章和相關條約...",
+        "這個議題涉及多方利益，需要平衡考慮..."
+    )
+}
+
+DEFAULT_RESPONSE_TEMPLATES = ("讓我來幫助您解決這個問題...",)
+
+# 模板佔位符與對應素材欄位
+TEMPLATE_PLACEHOLDER_POOLS = {
+    'expression': 'expressions',
+    'concept': 'concepts',
+    'language': 'languages',
+    'task': 'tasks',
+    'code': 'code_snippets',
+    'topic': 'topics',
+    'type': 'types',
+    'genre': 'genres',
+    'country': 'countries',
+    'issue': 'issues'
+}
+
+@dataclass(**_DATACLASS_SLOTS)
 class TrainingExample:
     """訓練範例數據結構"""
     domain: str
@@ -22,244 +188,125 @@ class TrainingExample:
     quality_score: float
     source: str
     timestamp: str
-    metadata: Dict[str, Any] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
 
 class TrainingDataManager:
     """訓練數據管理器"""
     
+    # 已建立過目錄結構的數據目錄
+    _dirs_created: Set[str] = set()
+    
     def __init__(self, data_dir: str = "./training_data"):
         self.data_dir = data_dir
-        self.ensure_directories()
+        self._load_cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._load_cache_lock = threading.Lock()
+        # 簡單的同義詞替換表，預先編譯成單一正則以一次掃描找出替換位置
+        self._synonyms = {
+            '幫我': ['協助我', '請幫助我', '能否幫我'],
+            '如何': ['怎麼', '怎樣', '如何才能'],
+            '什麼': ['甚麼', '何謂', '什麼是'],
+            '計算': ['算出', '求出', '運算'],
+            '解釋': ['說明', '闡述', '講解']
+        }
+        self._syn_re = re.compile('|'.join(re.escape(k) for k in self._synonyms))
+    
+    def __getstate__(self):
+        # 載入快取與鎖不跨行程傳遞（多行程生成數據時會pickle此物件）
+        state = self.__dict__.copy()
+        del state['_load_cache'], state['_load_cache_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_cache = OrderedDict()
+        self._load_cache_lock = threading.Lock()
         
     def ensure_directories(self):
-        """確保必要的目錄存在"""
-        directories = [
-            self.data_dir,
-            os.path.join(self.data_dir, "raw"),
-            os.path.join(self.data_dir, "processed"),
-            os.path.join(self.data_dir, "domains"),
-            os.path.join(self.data_dir, "quality_filtered")
-        ]
-        
-        for directory in directories:
-            os.makedirs(directory, exist_ok=True)
+        """確保必要的目錄存在（每個數據目錄只建立一次，於首次寫檔時呼叫）"""
+        if self.data_dir in TrainingDataManager._dirs_created:
+            return
+        
+        root = Path(self.data_dir)
+        for name in ("raw", "processed", "domains", "quality_filtered"):
+            (root / name).mkdir(parents=True, exist_ok=True)
+        TrainingDataManager._dirs_created.add(self.data_dir)
     
     def collect_conversation_data(self, conversations: List[Dict]) -> List[TrainingExample]:
         """從對話記錄中收集訓練數據"""
         training_examples = []
         
-        for conv in conversations:
-            if self._is_valid_conversation(conv):
-                example = TrainingExample(
-                    domain=conv.get('domain', 'general'),
-                    user_input=conv['user_message'],
-                    ai_response=conv['ai_response'],
-                    quality_score=self._calculate_quality_score(conv),
-                    source="user_conversations",
-                    timestamp=conv.get('timestamp', datetime.now().isoformat()),
-                    metadata={'conversation_id': conv.get('id')}
-                )
-                training_examples.append(example)
+        valid_conversations = [conv for conv in conversations if self._is_valid_conversation(conv)]
+        quality_scores = self._calculate_quality_scores_batch(valid_conversations).tolist()
+        
+        for conv, quality_score in zip(valid_conversations, quality_scores):
+            example = TrainingExample(
+                domain=conv.get('domain', 'general'),
+                user_input=conv['user_message'],
+                ai_response=conv['ai_response'],
+                quality_score=quality_score,
+                source="user_conversations",
+                timestamp=conv.get('timestamp', datetime.now().isoformat()),
+                metadata={'conversation_id': conv.get('id')}
+            )
+            training_examples.append(example)
         
         return training_examples
     
     def generate_synthetic_data(self, domain: str, count: int = 100) -> List[TrainingExample]:
         """生成合成訓練數據"""
-        synthetic_examples = []
-        
         domain_templates = self._get_domain_templates(domain)
         
-        for i in range(count):
-            template = random.choice(domain_templates)
-            user_input = self._generate_user_input(template, domain)
-            ai_response = self._generate_ai_response(template, domain)
-            
+        # 一次抽出所有範例的模板，再依模板分組批次抽取填充值
+        template_ids = random.choices(range(len(domain_templates)), k=count)
+        bucket_sizes = Counter(template_ids)
+        generated = {
+            template_id: iter(self._generate_user_inputs(domain_templates[template_id], size))
+            for template_id, size in bucket_sizes.items()
+        }
+        user_inputs = [next(generated[template_id]) for template_id in template_ids]
+        ai_responses = self._generate_ai_responses(domain, count)
+        # 同一批合成數據共用生成時間
+        timestamp = datetime.now().isoformat()
+        
+        synthetic_examples = []
+        for i, (template_id, user_input, ai_response) in enumerate(zip(template_ids, user_inputs, ai_responses)):
             example = TrainingExample(
                 domain=domain,
                 user_input=user_input,
                 ai_response=ai_response,
                 quality_score=0.8,  # 合成數據的基礎品質分數
                 source="synthetic_generation",
-                timestamp=datetime.now().isoformat(),
-                metadata={'template_id': template['id'], 'generation_round': i}
+                timestamp=timestamp,
+                metadata={'template_id': domain_templates[template_id]['id'], 'generation_round': i}
             )
             synthetic_examples.append(example)
         
         return synthetic_examples
     
-    def _get_domain_templates(self, domain: str) -> List[Dict]:
+    def _get_domain_templates(self, domain: str) -> Tuple[Dict, ...]:
         """獲取領域特定的模板"""
-        templates = {
-            'math': [
-                {
-                    'id': 'calculation',
-                    'user_patterns': [
-                        "計算 {expression}",
-                        "幫我算一下 {expression}",
-                        "{expression} 等於多少？",
-                        "求解 {expression}"
-                    ],
-                    'expressions': [
-                        "2 + 3 × 4", "√16 + 5²", "sin(30°)", "log₂(8)",
-                        "∫x²dx", "lim(x→0) sin(x)/x", "3x + 5 = 14"
-                    ]
-                },
-                {
-                    'id': 'concept',
-                    'user_patterns': [
-                        "什麼是{concept}？",
-                        "解釋一下{concept}",
-                        "{concept}的定義是什麼？",
-                        "如何理解{concept}？"
-                    ],
-                    'concepts': [
-                        "微積分", "線性代數", "機率論", "統計學",
-                        "幾何學", "三角函數", "複數", "矩陣"
-                    ]
-                }
-            ],
-            'programming': [
-                {
-                    'id': 'coding_problem',
-                    'user_patterns': [
-                        "如何用{language}實現{task}？",
-                        "寫一個{language}程式來{task}",
-                        "{language}中如何{task}？",
-                        "幫我寫{task}的代碼"
-                    ],
-                    'languages': ['Python', 'JavaScript', 'Java', 'C++', 'Go'],
-                    'tasks': [
-                        '排序陣列', '搜尋元素', '計算階乘', '反轉字串',
-                        '檢查回文', '生成斐波那契數列', '實現二分搜尋'
-                    ]
-                },
-                {
-                    'id': 'debugging',
-                    'user_patterns': [
-                        "這段代碼有什麼問題？{code}",
-                        "為什麼我的程式不工作？{code}",
-                        "幫我除錯：{code}",
-                        "修復這個錯誤：{code}"
-                    ],
-                    'code_snippets': [
-                        "for i in range(10) print(i)",
-                        "def factorial(n): return n * factorial(n-1)",
-                        "list = [1,2,3]; list.append(4); print(list[4])"
-                    ]
-                }
-            ],
-            'writing': [
-                {
-                    'id': 'creative_writing',
-                    'user_patterns': [
-                        "幫我寫一篇關於{topic}的{type}",
-                        "創作一個{genre}故事，主題是{topic}",
-                        "寫一段{type}，描述{topic}",
-                        "給我一個{topic}的{type}範例"
-                    ],
-                    'topics': ['友情', '冒險', '科技', '自然', '夢想', '成長'],
-                    'types': ['短文', '詩歌', '故事', '散文', '日記'],
-                    'genres': ['科幻', '奇幻', '懸疑', '愛情', '歷史']
-                }
-            ],
-            'dialogue': [
-                {
-                    'id': 'general_chat',
-                    'user_patterns': [
-                        "你覺得{topic}怎麼樣？",
-                        "我們來聊聊{topic}吧",
-                        "關於{topic}，你有什麼看法？",
-                        "談談你對{topic}的想法"
-                    ],
-                    'topics': [
-                        '人工智慧的未來', '環保議題', '教育改革', '科技發展',
-                        '文化差異', '生活哲學', '職業規劃', '健康生活'
-                    ]
-                }
-            ],
-            'mun': [
-                {
-                    'id': 'diplomatic_analysis',
-                    'user_patterns': [
-                        "分析{country}在{issue}上的立場",
-                        "{issue}的國際法依據是什麼？",
-                        "如何解決{issue}問題？",
-                        "{country}應該如何應對{issue}？"
-                    ],
-                    'countries': ['美國', '中國', '俄羅斯', '德國', '日本', '印度'],
-                    'issues': [
-                        '氣候變遷', '核武擴散', '貿易爭端', '難民危機',
-                        '網路安全', '太空軍備', '海洋權益', '人權問題'
-                    ]
-                }
-            ]
-        }
-        
-        return templates.get(domain, [])
-    
-    def _generate_user_input(self, template: Dict, domain: str) -> str:
-        """生成用戶輸入"""
-        pattern = random.choice(template['user_patterns'])
-        
-        # 根據模板類型填充變數
-        if 'expressions' in template:
-            expression = random.choice(template['expressions'])
-            return pattern.format(expression=expression)
-        elif 'concepts' in template:
-            concept = random.choice(template['concepts'])
-            return pattern.format(concept=concept)
-        elif 'languages' in template and 'tasks' in template:
-            language = random.choice(template['languages'])
-            task = random.choice(template['tasks'])
-            return pattern.format(language=language, task=task)
-        elif 'topics' in template:
-            topic = random.choice(template['topics'])
-            if 'types' in template:
-                type_val = random.choice(template['types'])
-                if 'genres' in template:
-                    genre = random.choice(template['genres'])
-                    return pattern.format(topic=topic, type=type_val, genre=genre)
-                return pattern.format(topic=topic, type=type_val)
-            return pattern.format(topic=topic)
-        elif 'countries' in template and 'issues' in template:
-            country = random.choice(template['countries'])
-            issue = random.choice(template['issues'])
-            return pattern.format(country=country, issue=issue)
-        
-        return pattern
+        return DOMAIN_TEMPLATES.get(domain, ())
     
-    def _generate_ai_response(self, template: Dict, domain: str) -> str:
-        """生成AI回應"""
-        response_templates = {
-            'math': [
-                "讓我來幫您解決這個數學問題。首先，我們需要...",
-                "這是一個很好的數學問題。根據相關定理...",
-                "我來為您詳細計算這個問題的步驟..."
-            ],
-            'programming': [
-                "這是一個常見的編程問題。讓我為您提供解決方案...",
-                "我來幫您分析這段代碼並提供改進建議...",
-                "這個問題可以用以下方法解決..."
-            ],
-            'writing': [
-                "我很樂意幫您創作。讓我們從以下角度開始...",
-                "這是一個很有創意的寫作主題。我建議...",
-                "讓我為您提供一些寫作靈感和結構建議..."
-            ],
-            'dialogue': [
-                "這是一個很有趣的話題。從我的角度來看...",
-                "關於這個問題，我認為我們可以從多個層面來討論...",
-                "這確實是值得深入思考的議題..."
-            ],
-            'mun': [
-                "從國際法的角度來分析這個問題...",
-                "根據聯合國憲章和相關條約...",
-                "這個議題涉及多方利益，需要平衡考慮..."
-            ]
+    def _generate_user_inputs(self, template: Dict, count: int) -> List[str]:
+        """批次生成同一模板的用戶輸入"""
+        patterns = random.choices(template['user_patterns'], k=count)
+        
+        # 根據模板提供的素材批次抽取各佔位符的值
+        columns = {
+            placeholder: random.choices(template[pool], k=count)
+            for placeholder, pool in TEMPLATE_PLACEHOLDER_POOLS.items()
+            if pool in template
         }
+        if not columns:
+            return patterns
         
-        templates_list = response_templates.get(domain, ["讓我來幫助您解決這個問題..."])
-        return random.choice(templates_list)
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        return [pattern.format_map(row) for pattern, row in zip(patterns, rows)]
+    
+    def _generate_ai_responses(self, domain: str, count: int) -> List[str]:
+        """批次生成AI回應"""
+        templates_list = RESPONSE_TEMPLATES.get(domain, DEFAULT_RESPONSE_TEMPLATES)
+        return random.choices(templates_list, k=count)
     
     def _is_valid_conversation(self, conv: Dict) -> bool:
         """檢查對話是否有效"""
@@ -268,32 +315,50 @@ class TrainingDataManager:
     
     def _calculate_quality_score(self, conv: Dict) -> float:
         """計算對話品質分數"""
-        score = 0.5  # 基礎分數
+        return float(self._calculate_quality_scores_batch([conv])[0])
+    
+    def _calculate_quality_scores_batch(self, conversations: List[Dict]) -> np.ndarray:
+        """批次計算對話品質分數"""
+        n = len(conversations)
+        response_lengths = np.fromiter((len(c['ai_response']) for c in conversations), dtype=np.int32, count=n)
+        input_lengths = np.fromiter((len(c['user_message']) for c in conversations), dtype=np.int32, count=n)
+        has_question = np.fromiter(('?' in c['user_message'] for c in conversations), dtype=bool, count=n)
+        has_domain = np.fromiter((c.get('domain', 'general') != 'general' for c in conversations),
+                                 dtype=bool, count=n)
         
+        score = np.full(n, 0.5)  # 基礎分數
         # 回應長度評分
-        response_length = len(conv['ai_response'])
-        if response_length > 100:
-            score += 0.2
-        elif response_length > 50:
-            score += 0.1
-        
+        score += 0.2 * (response_lengths > 100) + 0.1 * ((response_lengths > 50) & (response_lengths <= 100))
         # 用戶輸入品質評分
-        user_input = conv['user_message']
-        if len(user_input) > 10 and '?' in user_input:
-            score += 0.1
-        
+        score += 0.1 * ((input_lengths > 10) & has_question)
         # 領域相關性評分
-        domain = conv.get('domain', 'general')
-        if domain != 'general':
-            score += 0.1
+        score += 0.1 * has_domain
         
         # 確保分數在0-1範圍內
-        return min(max(score, 0.0), 1.0)
+        return np.clip(score, 0.0, 1.0, out=score)
     
     def save_training_data(self, examples: List[TrainingExample], filename: str):
         """保存訓練數據"""
+        self.ensure_directories()
+        filepath = os.path.join(self.data_dir, "processed", filename)
+        
+        with open(filepath, 'wb') as f:
+            f.write(self._dump_examples(examples))
+        
+        print(f"已保存 {len(examples)} 個訓練範例到 {filepath}")
+    
+    async def save_training_data_async(self, examples: List[TrainingExample], filename: str):
+        """非同步保存訓練數據，避免寫檔阻塞事件迴圈"""
+        self.ensure_directories()
         filepath = os.path.join(self.data_dir, "processed", filename)
         
+        async with aiofiles.open(filepath, 'wb') as f:
+            await f.write(self._dump_examples(examples))
+        
+        print(f"已保存 {len(examples)} 個訓練範例到 {filepath}")
+    
+    def _dump_examples(self, examples: List[TrainingExample]) -> bytes:
+        """將訓練範例序列化為JSON位元組"""
         data_to_save = []
         for example in examples:
             data_to_save.append({
@@ -303,26 +368,41 @@ class TrainingDataManager:
                 'quality_score': example.quality_score,
                 'source': example.source,
                 'timestamp': example.timestamp,
-                'metadata': example.metadata or {}
+                'metadata': example.metadata
             })
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=2)
-        
-        print(f"已保存 {len(examples)} 個訓練範例到 {filepath}")
+        return orjson.dumps(data_to_save, option=orjson.OPT_INDENT_2)
     
     def load_training_data(self, filename: str) -> List[TrainingExample]:
         """載入訓練數據"""
-        filepath = os.path.join(self.data_dir, "processed", filename)
-        
-        if not os.path.exists(filepath):
+        return self.load_training_file(os.path.join(self.data_dir, "processed", filename))
+    
+    def load_training_file(self, filepath: str) -> List[TrainingExample]:
+        """依路徑載入訓練數據；檔案未變動時重用已解析的記錄，每次仍回傳新的範例物件"""
+        try:
+            mtime = os.stat(filepath).st_mtime_ns
+        except FileNotFoundError:
             return []
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        key = (filepath, mtime)
+        with self._load_cache_lock:
+            records = self._load_cache.get(key)
+            if records is not None:
+                self._load_cache.move_to_end(key)
         
+        if records is None:
+            with open(filepath, 'rb', buffering=_READ_BUFFER_SIZE) as f:
+                records = orjson.loads(f.read())
+            
+            with self._load_cache_lock:
+                self._load_cache[key] = records
+                self._load_cache.move_to_end(key)
+                while len(self._load_cache) > _LOAD_CACHE_SIZE:
+                    self._load_cache.popitem(last=False)
+        
+        # 快取中保留的是解析後的原始記錄，呼叫端修改範例或其metadata不會影響之後的載入
         examples = []
-        for item in data:
+        for item in records:
             example = TrainingExample(
                 domain=item['domain'],
                 user_input=item['user_input'],
@@ -330,12 +410,22 @@ class TrainingDataManager:
                 quality_score=item['quality_score'],
                 source=item['source'],
                 timestamp=item['timestamp'],
-                metadata=item.get('metadata', {})
+                metadata=dict(item.get('metadata') or {})
             )
             examples.append(example)
         
         return examples
     
+    def to_arrays(self, examples: List[TrainingExample]) -> Dict[str, np.ndarray]:
+        """將訓練範例轉為欄位陣列（每個欄位一個陣列），供批次統計使用"""
+        n = len(examples)
+        return {
+            'domain': np.array([ex.domain for ex in examples], dtype=object),
+            'input_len': np.fromiter((len(ex.user_input) for ex in examples), dtype=np.int32, count=n),
+            'output_len': np.fromiter((len(ex.ai_response) for ex in examples), dtype=np.int32, count=n),
+            'quality_score': np.fromiter((ex.quality_score for ex in examples), dtype=np.float64, count=n)
+        }
+    
     def filter_by_quality(self, examples: List[TrainingExample], 
                          min_score: float = 0.7) -> List[TrainingExample]:
         """根據品質分數過濾訓練數據"""
@@ -359,32 +449,42 @@ class TrainingDataManager:
     
     def _create_variant(self, example: TrainingExample) -> Optional[TrainingExample]:
         """創建數據變體"""
-        # 簡單的同義詞替換
-        synonyms = {
-            '幫我': ['協助我', '請幫助我', '能否幫我'],
-            '如何': ['怎麼', '怎樣', '如何才能'],
-            '什麼': ['甚麼', '何謂', '什麼是'],
-            '計算': ['算出', '求出', '運算'],
-            '解釋': ['說明', '闡述', '講解']
-        }
-        
         user_input = example.user_input
-        for original, replacements in synonyms.items():
-            if original in user_input:
-                replacement = random.choice(replacements)
-                new_input = user_input.replace(original, replacement, 1)
-                
-                return TrainingExample(
-                    domain=example.domain,
-                    user_input=new_input,
-                    ai_response=example.ai_response,
-                    quality_score=example.quality_score * 0.9,  # 略微降低變體分數
-                    source=f"{example.source}_variant",
-                    timestamp=datetime.now().isoformat(),
-                    metadata={**example.metadata, 'is_variant': True}
-                )
-        
-        return None
+        match = self._syn_re.search(user_input)
+        if not match:
+            return None
+        
+        replacement = random.choice(self._synonyms[match.group(0)])
+        new_input = user_input[:match.start()] + replacement + user_input[match.end():]
+        
+        metadata = dict(example.metadata) if example.metadata else {}
+        metadata['is_variant'] = True
+        
+        return TrainingExample(
+            domain=example.domain,
+            user_input=new_input,
+            ai_response=example.ai_response,
+            quality_score=example.quality_score * 0.9,  # 略微降低變體分數
+            source=f"{example.source}_variant",
+            timestamp=datetime.now().isoformat(),
+            metadata=metadata
+        )
+    
+    def generate_domain_dataset(self, domain: str, examples_per_domain: int = 200) -> List[TrainingExample]:
+        """生成單一領域的訓練數據（合成、增強、品質過濾）"""
+        print(f"正在為 {domain} 領域生成訓練數據...")
+        
+        # 生成合成數據
+        synthetic_data = self.generate_synthetic_data(domain, examples_per_domain)
+        
+        # 數據增強
+        augmented_data = self.augment_data(synthetic_data)
+        
+        # 品質過濾
+        filtered_data = self.filter_by_quality(augmented_data, min_score=0.6)
+        
+        print(f"{domain} 領域生成了 {len(filtered_data)} 個高品質訓練範例")
+        return filtered_data
     
     def generate_comprehensive_dataset(self, domains: List[str], 
                                      examples_per_domain: int = 200) -> List[TrainingExample]:
@@ -392,19 +492,7 @@ class TrainingDataManager:
         all_examples = []
         
         for domain in domains:
-            print(f"正在為 {domain} 領域生成訓練數據...")
-            
-            # 生成合成數據
-            synthetic_data = self.generate_synthetic_data(domain, examples_per_domain)
-            
-            # 數據增強
-            augmented_data = self.augment_data(synthetic_data)
-            
-            # 品質過濾
-            filtered_data = self.filter_by_quality(augmented_data, min_score=0.6)
-            
-            all_examples.extend(filtered_data)
-            print(f"{domain} 領域生成了 {len(filtered_data)} 個高品質訓練範例")
+            all_examples.extend(self.generate_domain_dataset(domain, examples_per_domain))
         
         return all_examples
 